@@ -3,9 +3,21 @@ from requests.exceptions import HTTPError, Timeout, RequestException
 from tqdm import tqdm
 
 from typing import TypedDict
+from contextlib import contextmanager
 import json, re, os, sys
 import hashlib
 import argparse
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+try:
+    import yaml
+except ImportError:  # Only needed for YAML job files
+    yaml = None
 
 
 class GameNotFound(Exception):
@@ -16,6 +28,14 @@ class VersionNotFound(Exception):
     pass
 
 
+class StoreError(Exception):
+    pass
+
+
+class JobSpecError(Exception):
+    pass
+
+
 class OSManager:
     @staticmethod
     def exit(exit_code: int = 0):
@@ -138,7 +158,8 @@ class ApiParser:
         self.json_response: dict = ApiHandler().send_request()
         self.json_response = self.json_response["data"]["game_packages"]
 
-    def _convert_bytes(self, byte_size: int) -> str:
+    @staticmethod
+    def _convert_bytes(byte_size: int) -> str:
         units = ["B", "KB", "MB", "GB"]
 
         if not byte_size:
@@ -175,6 +196,15 @@ class ApiParser:
 
         return list_of_id_games[selected_game]
 
+    def find_game_id(self, game: str) -> str:
+        gamelist: dict = self._get_gamelist()
+        if game in gamelist:
+            return game
+        for game_id, name in gamelist.items():
+            if name.lower() == game.lower():
+                return game_id
+        raise GameNotFound(f"Game '{game}' is not in gamelist.json.")
+
     def find_game(self, game_id: str) -> int:
         for game_index in range(len(self.json_response)):
             if self.json_response[game_index]["game"]["id"] == game_id:
@@ -239,6 +269,36 @@ class ApiParser:
         print(f"Selected: {version_list[previous_ver - 1]}\n")
         return game_patches[previous_ver - 1]
 
+    def get_version_targets(
+        self, game_index: int, version: str
+    ) -> list[tuple[str, dict], ...]:
+        # Non-interactive counterpart of get_game_main + get_game_major/get_game_patches.
+        # version: [pre_download:](major | patches | patch:<current version>)
+        if version == "pre_download":
+            version = "pre_download:major"
+        source, _, kind = (
+            version.partition(":")
+            if version.startswith("pre_download:")
+            else ("main", "", version)
+        )
+
+        if source == "pre_download" and not self.is_pre_download(game_index):
+            raise VersionNotFound("Pre-download is not available.")
+        game_main: dict = self.json_response[game_index][source]
+
+        if kind == "major":
+            return [(f"{source}-{game_main['major']['version']}", game_main["major"])]
+        if kind == "patches":
+            return [
+                (f"{source}-patch-{patch['version']}", patch)
+                for patch in game_main["patches"]
+            ]
+        if kind.startswith("patch:"):
+            for patch in game_main["patches"]:
+                if patch["version"] == kind[len("patch:") :]:
+                    return [(f"{source}-patch-{patch['version']}", patch)]
+        raise VersionNotFound(f"Requested version '{version}' not found.")
+
     def _print_pkg_info(
         self,
         total_size,
@@ -263,6 +323,7 @@ class ApiParser:
         types: list = ["game_pkgs", "audio_pkgs"],
         languages: list[str, ...] = ["en-us"],
         print_info: bool = False,
+        print_summary: bool = True,
     ) -> list[tuple[str, int, str], ...]:
         pkgs: list[dict] = [game_major.get(t) for t in set(types) if game_major.get(t)]
         languages = set(languages)
@@ -298,13 +359,14 @@ class ApiParser:
                     (pkg_info["url"], int(pkg_info["size"]), pkg_info["md5"])
                 )
 
-        self._print_pkg_info(
-            total_size,
-            total_decompressed_size,
-            languages,
-            audio_total_size,
-            audio_total_decompressed_size,
-        )
+        if print_summary:
+            self._print_pkg_info(
+                total_size,
+                total_decompressed_size,
+                languages,
+                audio_total_size,
+                audio_total_decompressed_size,
+            )
         return lst_of_pkgs
 
     def main(
@@ -329,9 +391,233 @@ class ApiParser:
         )
 
 
+class BatchPlanner:
+    def __init__(self, api_parser: ApiParser = None):
+        self.api_parser: ApiParser = api_parser or ApiParser()  # One API snapshot
+
+    @staticmethod
+    def load_spec(job_file: str) -> dict:
+        errors: tuple = (IOError, ValueError) + ((yaml.YAMLError,) if yaml else ())
+        try:
+            with open(job_file, "r", encoding="utf-8") as file:
+                if job_file.endswith((".yaml", ".yml")):
+                    if yaml is None:
+                        raise JobSpecError("PyYAML is required to read YAML job files.")
+                    spec = yaml.safe_load(file) or {}
+                else:
+                    spec = json.load(file)
+        except errors as err:
+            raise JobSpecError(f"Unable to read job file '{job_file}': {err}")
+
+        if not isinstance(spec, dict) or not isinstance(spec.get("jobs", []), list):
+            raise JobSpecError(f"Job file '{job_file}' must contain a 'jobs' list.")
+        return spec
+
+    def expand_jobs(self, spec: dict) -> list[dict]:
+        jobs: list[dict] = []
+        for job in spec.get("jobs", []):
+            if not isinstance(job, dict):
+                raise JobSpecError(f"Invalid job {job!r}, expected a mapping.")
+
+            games = job.get("games", job.get("game", []))
+            games = [games] if isinstance(games, str) else games
+            if games == ["all"]:
+                games = list(self.api_parser._get_gamelist())
+
+            types = job.get("types", spec.get("types", ["game_pkgs", "audio_pkgs"]))
+            if isinstance(types, str):
+                types = ["game_pkgs", "audio_pkgs"] if types == "all" else [types]
+            languages = job.get("languages", spec.get("languages", ["en-us"]))
+            if isinstance(languages, str):
+                languages = [languages]
+            versions = job.get("versions", ["major"])
+            if isinstance(versions, str):
+                versions = [versions]
+
+            for field, value in (
+                ("games", games),
+                ("types", types),
+                ("languages", languages),
+                ("versions", versions),
+            ):
+                if not isinstance(value, list) or not all(
+                    isinstance(item, str) for item in value
+                ):
+                    raise JobSpecError(f"Invalid '{field}' in job {job!r}.")
+
+            for game in games:
+                jobs.append(
+                    {
+                        "game": game,
+                        "versions": versions,
+                        "types": types,
+                        "languages": languages,
+                    }
+                )
+        return jobs
+
+    def plan(self, spec: dict) -> list[tuple[str, int, str, list[str]], ...]:
+        # Every game/version gets its own <game_id>/<label> folder. A package shared
+        # between entries is downloaded once and placed into each of its folders.
+        gamelist: dict = self.api_parser._get_gamelist()
+        queue: dict[tuple[str, int], tuple[str, int, str, list[str]]] = {}
+        requested = 0
+
+        for job in self.expand_jobs(spec):
+            try:
+                game_id: str = self.api_parser.find_game_id(job["game"])
+                game_index: int = self.api_parser.find_game(game_id)
+            except GameNotFound as err:
+                print(f"WARNING: {gamelist.get(job['game'], job['game'])}: {err} Skipping.")
+                continue
+
+            for version in job["versions"]:
+                try:
+                    targets = self.api_parser.get_version_targets(game_index, version)
+                except VersionNotFound as err:
+                    print(f"WARNING: {gamelist.get(game_id, game_id)}: {err} Skipping.")
+                    continue
+
+                for label, game_major in targets:
+                    pkgs = self.api_parser.get_game_pkgs(
+                        game_major,
+                        types=job["types"],
+                        languages=job["languages"],
+                        print_summary=False,
+                    )
+                    print(
+                        f"{gamelist.get(game_id, game_id)} | {label} | {len(pkgs)} packages, "
+                        f"{ApiParser._convert_bytes(sum(size for _, size, _ in pkgs))}"
+                    )
+
+                    subdir = os.path.join(game_id, label)
+                    for url, size, md5 in pkgs:
+                        requested += 1
+                        key = (md5.lower(), size)
+                        queue.setdefault(key, (url, size, md5, []))
+                        if subdir not in queue[key][3]:
+                            queue[key][3].append(subdir)
+
+        items = list(queue.values())
+        print(
+            f"\nBatch: {len(items)} packages ({requested - len(items)} duplicates removed), "
+            f"total size {ApiParser._convert_bytes(sum(size for _, size, _, _ in items))}\n"
+        )
+        return items
+
+
 class Downloader:
-    def __init__(self, path: str = ""):
+    def __init__(
+        self, path: str = "", block_size: int = 4194304, store: "PackageStore" = None
+    ):
         self.path: str = path
+        self.block_size: int = block_size
+        self.store: PackageStore = store
+        self.total_bar: tqdm = None
+        self.session: requests.Session = requests.Session()  # Reuse connections
+
+    def _fetch_range(self, url: str, start: int, end: int) -> bytes:
+        headers = {"Range": f"bytes={start}-{end}"}
+        with self.session.get(url, headers=headers, timeout=10) as response:
+            if response.status_code != 206:
+                raise RequestException(
+                    f"Server did not honor range request, status code: {response.status_code}"
+                )
+            return response.content
+
+    def _patch_block(self, url: str, filepath: str, index: int, filesize: int) -> bytes:
+        start = index * self.block_size
+        end = min(start + self.block_size, filesize) - 1
+        data = self._fetch_range(url, start, end)
+        with open(filepath, "r+b") as f:
+            f.seek(start)
+            f.write(data)
+        return data
+
+    def _scan_repair(self, url: str, filepath: str, filesize: int, md5: str) -> bool:
+        # Without trustworthy block digests the server is the only reference, so compare
+        # block by block. The whole-file MD5 runs once per contiguous run of patched
+        # blocks, which allows an early exit without rehashing after every block.
+        filename = os.path.basename(filepath)
+        print(f"Comparing {filename} against the server block by block...")
+
+        def verified() -> bool:
+            file_hash, blocks = CheckHash.calculate_md5_blocks_ui(
+                filepath, self.block_size
+            )
+            if file_hash.lower() != md5.lower():
+                print(f"CRC Failed! Expected {md5}, got {file_hash}")
+                return False
+
+            print("CRC OK!")
+            BlockManifest.save(filepath, md5, self.block_size, blocks)
+            return True
+
+        in_bad_run = False
+        with (
+            open(filepath, "r+b") as local_file,
+            tqdm(total=filesize, unit="B", unit_scale=True, desc="Scan") as progress_bar,
+        ):
+            for index in range(BlockHasher.block_count(filesize, self.block_size)):
+                start = index * self.block_size
+                end = min(start + self.block_size, filesize) - 1
+                remote = self._fetch_range(url, start, end)
+
+                local_file.seek(start)
+                if local_file.read(len(remote)) != remote:
+                    local_file.seek(start)
+                    local_file.write(remote)
+                    progress_bar.write(f"Patched block {index} (bytes {start}-{end})")
+                    in_bad_run = True
+                elif in_bad_run:
+                    in_bad_run = False
+                    local_file.flush()
+                    if verified():
+                        return True
+
+                progress_bar.update(len(remote))
+
+        # The file is closed (and flushed) here; only check if the last run is unchecked
+        return in_bad_run and verified()
+
+    def repair_file(self, url: str, filename: str, filesize: int, md5: str) -> bool:
+        filepath = os.path.join(self.path, filename)
+
+        if not os.path.exists(filepath):
+            return False
+        if os.path.getsize(filepath) != filesize:
+            print(f"Cannot repair {filename}: size mismatch.")
+            return False
+
+        try:
+            reference = BlockManifest.load(filepath, md5, filesize, self.block_size)
+            if reference:
+                local = CheckHash.calculate_block_md5(filepath, self.block_size)
+                bad_blocks = [
+                    index
+                    for index, (actual, expected) in enumerate(zip(local, reference))
+                    if actual != expected
+                ]
+                if bad_blocks:
+                    print(
+                        f"{len(bad_blocks)} corrupted block(s) in {filename}. Re-fetching..."
+                    )
+                    for index in bad_blocks:
+                        self._patch_block(url, filepath, index, filesize)
+
+                    if CheckHash.check_md5(filepath, md5):
+                        return True
+
+            return self._scan_repair(url, filepath, filesize, md5)
+
+        except KeyboardInterrupt:
+            print("\nRepair canceled.")
+            OSManager.exit(0)
+        except IOError:
+            print(f"Unable to repair: {filename}")
+        except RequestException as req_err:
+            print(f"Error occurred during the request: {req_err}")
+        return False
 
     def download_file(self, url: str, filename: str, filesize: int, md5: str):
         tmp_filename = filename + ".tmp"
@@ -343,9 +629,13 @@ class Downloader:
             if CheckHash.check_md5(final_filepath, md5):
                 print(f"Skip download: {filename} is valid.")
                 return
+            elif self.repair_file(url, filename, filesize, md5):
+                print(f"Repaired: {filename}")
+                return
             else:
                 print(f"CRC failed! Re-downloading: {filename}")
                 os.remove(final_filepath)
+                BlockManifest.remove(final_filepath)
 
         downloaded = 0
         if os.path.exists(tmp_filepath):
@@ -358,11 +648,21 @@ class Downloader:
                 f"Resuming {filename} from byte {downloaded} ({downloaded / 1073741824:.2f}GB)"
             )
 
+        hasher: BlockHasher = None
         try:
-            with requests.get(
+            with self.session.get(
                 url, stream=True, headers=headers, timeout=10
             ) as response:
                 if response.status_code in (200, 206):
+                    if response.status_code == 200:
+                        downloaded = 0  # Server ignored the range, start over
+
+                    hasher = BlockHasher.resume(
+                        tmp_filepath,
+                        downloaded,
+                        self.block_size,
+                        BlockManifest.load_partial(final_filepath, md5, self.block_size),
+                    )
                     mode = "ab" if downloaded > 0 else "wb"
                     with (
                         open(tmp_filepath, mode) as f,
@@ -377,7 +677,10 @@ class Downloader:
                         for chunk in response.iter_content(chunk_size=65536):
                             if chunk:
                                 f.write(chunk)
+                                hasher.update(chunk)
                                 progress_bar.update(len(chunk))
+                                if self.total_bar:
+                                    self.total_bar.update(len(chunk))
                 else:
                     print(
                         f"Failed to download {filename}, status code: {response.status_code}"
@@ -385,6 +688,8 @@ class Downloader:
                     return
 
             os.rename(tmp_filepath, final_filepath)
+            BlockManifest.save(final_filepath, md5, self.block_size, hasher.finalize())
+            hasher = None
             print(f"Download completed: {filename}")
 
         except KeyboardInterrupt:
@@ -405,19 +710,336 @@ class Downloader:
             print(f"Error occurred during the request: {req_err}")
         except Exception as err:
             print(f"Error downloading {filename}: {err}")
+        finally:
+            if hasher:  # Keep digests of the blocks written so far for resuming
+                BlockManifest.save(final_filepath, md5, self.block_size, hasher.digests)
+
+    def _in_dir(self, subdir: str) -> "Downloader":
+        downloader = Downloader(
+            path=os.path.join(self.path, subdir),
+            block_size=self.block_size,
+            store=self.store,
+        )
+        downloader.total_bar = self.total_bar
+        downloader.session = self.session
+        os.makedirs(downloader.path or ".", exist_ok=True)
+        return downloader
+
+    def _present_size(
+        self, filename: str, filesize: int, md5: str, subdir: str = ""
+    ) -> int:
+        if self.store and os.path.exists(
+            os.path.join(self.store.objects_dir, PackageStore.key(md5, filesize))
+        ):
+            return filesize
+
+        filepath = os.path.join(self.path, subdir, filename)
+        if os.path.exists(filepath):
+            return filesize
+        if os.path.exists(filepath + ".tmp"):
+            return os.path.getsize(filepath + ".tmp")
+        return 0
 
     def download_files(
-        self, items: list[tuple[str, int, str], ...]
+        self, items: list[tuple[str, int, str], ...], show_total: bool = False
     ) -> list[tuple[str, str], ...]:
+        # items: (url, size, md5) or (url, size, md5, subdirs) to place one download
+        # into several subdirectories of self.path
+        items = [(url, size, md5, *(extra or [[""]])) for url, size, md5, *extra in items]
+
+        if show_total:
+            total_size = sum(filesize for _, filesize, _, _ in items)
+            present = sum(
+                self._present_size(url.split("/")[-1], filesize, md5, subdirs[0])
+                for url, filesize, md5, subdirs in items
+            )
+            print(f"Remaining: {ApiParser._convert_bytes(total_size - present)}\n")
+            self.total_bar = tqdm(
+                total=total_size,
+                initial=present,
+                unit="B",
+                unit_scale=True,
+                desc="Total",
+                position=0,
+            )
+
         file_hash: list[tuple[str, str], ...] = []
-        for url, filesize, md5 in items:
-            filename: str = url.split("/")[-1]
-            self.download_file(url=url, filename=filename, filesize=filesize, md5=md5)
-            file_hash.append((os.path.join(self.path, filename), md5))
-            print()  # Separate multiple downloads for easy viewing
+        try:
+            for url, filesize, md5, subdirs in items:
+                filename: str = url.split("/")[-1]
+                first_path: str = os.path.join(self.path, subdirs[0], filename)
+
+                for subdir in subdirs:
+                    downloader = self._in_dir(subdir) if subdir else self
+                    filepath = os.path.join(downloader.path, filename)
+
+                    if self.store:
+                        self.store.provide(
+                            url=url,
+                            filename=filename,
+                            filesize=filesize,
+                            md5=md5,
+                            target_dir=downloader.path,
+                            block_size=self.block_size,
+                            total_bar=self.total_bar,
+                        )
+                    elif (
+                        filepath != first_path
+                        and os.path.exists(first_path)
+                        and not os.path.exists(filepath)
+                    ):
+                        PackageStore._place(first_path, filepath, hardlink=False)
+                        if os.path.exists(BlockManifest.path(first_path)):
+                            shutil.copyfile(
+                                BlockManifest.path(first_path),
+                                BlockManifest.path(filepath),
+                            )
+                        print(f"Copied {filename} to {downloader.path}")
+                    else:
+                        downloader.download_file(
+                            url=url, filename=filename, filesize=filesize, md5=md5
+                        )
+
+                    file_hash.append((filepath, md5))
+                    if not os.path.exists(first_path):
+                        break  # Skipped or failed, do not start over in other folders
+                print()  # Separate multiple downloads for easy viewing
+        finally:
+            if self.total_bar:
+                self.total_bar.close()
+                self.total_bar = None
         return file_hash
 
 
+class PackageStore:
+    FICLONE = 0x40049409  # Linux ioctl for reflink copies (btrfs, xfs, ...)
+
+    def __init__(self, root: str, max_size: int = None):
+        if fcntl is None:
+            raise StoreError("The package store requires fcntl file locking (POSIX).")
+
+        self.root: str = root
+        self.max_size: int = max_size
+        self.objects_dir: str = os.path.join(root, "objects")
+        self.locks_dir: str = os.path.join(root, "locks")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+    @staticmethod
+    def key(md5: str, filesize: int) -> str:
+        return f"{md5.lower()}-{filesize}"
+
+    @contextmanager
+    def _lock(self, name: str, blocking: bool = True):
+        # Lock files of evicted keys are unlinked while locked, so after acquiring the
+        # lock make sure the path still refers to the locked file, otherwise retry.
+        lock_path = os.path.join(self.locks_dir, name + ".lock")
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            with open(lock_path, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, flags)
+                except BlockingIOError:
+                    yield False
+                    return
+
+                try:
+                    current = os.stat(lock_path).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current != os.fstat(lock_file.fileno()).st_ino:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    continue
+
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+
+    @staticmethod
+    def _reflink(src: str, dst: str):
+        if fcntl is None:
+            raise OSError("reflink is not supported on this platform")
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), PackageStore.FICLONE, src_file.fileno())
+
+    @staticmethod
+    def _place(obj_path: str, target: str, hardlink: bool = True) -> str:
+        if os.path.exists(target) and os.path.samefile(obj_path, target):
+            return "hardlink"
+
+        tmp_target = target + ".store"
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+
+        try:
+            if not hardlink:
+                raise OSError("hardlink not requested")
+            os.link(obj_path, tmp_target)
+            method = "hardlink"
+        except OSError:
+            try:
+                PackageStore._reflink(obj_path, tmp_target)
+                method = "reflink"
+            except OSError:
+                if os.path.exists(tmp_target):
+                    os.remove(tmp_target)
+                shutil.copyfile(obj_path, tmp_target)
+                method = "copy"
+
+        os.replace(tmp_target, target)
+        return method
+
+    def _fill(
+        self,
+        key: str,
+        url: str,
+        filesize: int,
+        md5: str,
+        block_size: int,
+        total_bar: tqdm = None,
+    ) -> bool:
+        downloader = Downloader(path=self.objects_dir, block_size=block_size)
+        downloader.total_bar = total_bar
+        downloader.download_file(url=url, filename=key, filesize=filesize, md5=md5)
+
+        obj_path = os.path.join(self.objects_dir, key)
+        if not os.path.exists(obj_path):
+            return False
+
+        if not CheckHash.check_md5(obj_path, md5) and not downloader.repair_file(
+            url=url, filename=key, filesize=filesize, md5=md5
+        ):
+            print(f"Not adding {key} to the store: CRC failed.")
+            os.remove(obj_path)
+            BlockManifest.remove(obj_path)
+            return False
+
+        os.chmod(obj_path, 0o444)  # Shared by every linked target
+        return True
+
+    def _adopt(self, key: str, target: str, filesize: int, md5: str) -> bool:
+        # A valid package already in the target folder fills the store without a download
+        if not os.path.isfile(target) or os.path.getsize(target) != filesize:
+            return False
+        if not CheckHash.check_md5(target, md5):
+            return False
+
+        obj_path = os.path.join(self.objects_dir, key)
+        try:
+            os.link(target, obj_path)
+        except OSError:
+            shutil.copyfile(target, obj_path + ".tmp")
+            os.replace(obj_path + ".tmp", obj_path)
+
+        if os.path.exists(BlockManifest.path(target)):
+            shutil.copyfile(BlockManifest.path(target), BlockManifest.path(obj_path))
+        os.chmod(obj_path, 0o444)
+        return True
+
+    def provide(
+        self,
+        url: str,
+        filename: str,
+        filesize: int,
+        md5: str,
+        target_dir: str = "",
+        block_size: int = 4194304,
+        total_bar: tqdm = None,
+    ):
+        key = self.key(md5, filesize)
+        obj_path = os.path.join(self.objects_dir, key)
+        target = os.path.join(target_dir, filename)
+
+        with self._lock(key):
+            if os.path.exists(obj_path):
+                print(f"Found in store: {filename}")
+            elif self._adopt(key, target, filesize, md5):
+                print(f"Added to store from download folder: {filename}")
+            elif not self._fill(key, url, filesize, md5, block_size, total_bar):
+                return
+
+            os.utime(obj_path)  # mtime is the LRU timestamp
+            try:
+                method = self._place(obj_path, target)
+            except IOError as err:
+                print(f"Unable to place {filename} from store: {err}")
+                return
+            print(f"Placed {filename} ({method})")
+
+        self.evict(keep=key)
+
+    def repair(
+        self,
+        url: str,
+        filename: str,
+        filesize: int,
+        md5: str,
+        target_dir: str = "",
+        block_size: int = 4194304,
+    ) -> bool:
+        # The object is repaired in place, which also fixes every hardlinked target.
+        # Copied or reflinked targets are placed again afterwards.
+        key = self.key(md5, filesize)
+        obj_path = os.path.join(self.objects_dir, key)
+        target = os.path.join(target_dir, filename)
+
+        with self._lock(key):
+            if not os.path.exists(obj_path):
+                return False
+
+            if not CheckHash.check_md5(obj_path, md5):
+                os.chmod(obj_path, 0o644)
+                repaired = Downloader(
+                    path=self.objects_dir, block_size=block_size
+                ).repair_file(url=url, filename=key, filesize=filesize, md5=md5)
+                if not repaired:
+                    print(f"Removing corrupted package from store: {key}")
+                    os.remove(obj_path)
+                    BlockManifest.remove(obj_path)
+                    return False
+                os.chmod(obj_path, 0o444)
+
+            try:
+                method = self._place(obj_path, target)
+            except IOError as err:
+                print(f"Unable to place {filename} from store: {err}")
+                return False
+            print(f"Placed {filename} ({method})")
+        return True
+
+    def evict(self, keep: str = None):
+        if self.max_size is None:
+            return
+
+        with self._lock("store"):
+            entries: list[tuple[float, int, str]] = []
+            for name in os.listdir(self.objects_dir):
+                path = os.path.join(self.objects_dir, name)
+                if name.endswith((".tmp", ".blocks")) or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if name == keep:
+                    continue
+
+                with self._lock(name, blocking=False) as acquired:
+                    if not acquired:  # In use by another process
+                        continue
+                    path = os.path.join(self.objects_dir, name)
+                    os.remove(path)
+                    BlockManifest.remove(path)
+                    os.remove(os.path.join(self.locks_dir, name + ".lock"))
+                    total -= size
+                    print(f"Evicted from store: {name}")
+
+
 class CheckHash:
     @staticmethod
     def calculate_md5(filepath: str, chunk_size: int = 4096) -> str:
@@ -441,6 +1063,31 @@ class CheckHash:
                     progress_bar.update(len(chunk))
         return hash_md5.hexdigest()
 
+    @staticmethod
+    def calculate_md5_blocks_ui(filepath: str, block_size: int) -> (str, list[str]):
+        # Whole-file MD5 and per-block digests in a single read
+        hash_md5: _hashlib.HASH = hashlib.md5()
+        digests: list[str] = []
+        file_size = os.path.getsize(filepath)
+
+        with open(filepath, "rb") as file:
+            with tqdm(
+                total=file_size, unit="B", unit_scale=True, desc="MD5", position=0
+            ) as progress_bar:
+                for block in iter(lambda: file.read(block_size), b""):
+                    hash_md5.update(block)
+                    digests.append(hashlib.md5(block).hexdigest())
+                    progress_bar.update(len(block))
+        return hash_md5.hexdigest(), digests
+
+    @staticmethod
+    def calculate_block_md5(filepath: str, block_size: int) -> list[str]:
+        digests: list[str] = []
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digests.append(hashlib.md5(block).hexdigest())
+        return digests
+
     @staticmethod
     def check_md5(filepath: str, expected_md5: str) -> bool:
         print(f"\nRunning CRC: {filepath}.", end="\n")
@@ -466,6 +1113,97 @@ class CheckHash:
         return False
 
 
+class BlockHasher:
+    def __init__(self, block_size: int, digests: list[str] = None):
+        self.block_size: int = block_size
+        self.digests: list[str] = list(digests or [])
+        self._hash = hashlib.md5()
+        self._filled: int = 0
+
+    @staticmethod
+    def block_count(filesize: int, block_size: int) -> int:
+        return -(-filesize // block_size)
+
+    @classmethod
+    def resume(
+        cls, filepath: str, offset: int, block_size: int, digests: list[str]
+    ) -> "BlockHasher":
+        full_blocks = offset // block_size
+        hasher = cls(block_size, digests[:full_blocks])
+
+        if offset > 0:
+            with open(filepath, "rb") as f:
+                # Digests missing from the manifest (e.g. after a crash) are rebuilt from disk
+                f.seek(len(hasher.digests) * block_size)
+                while len(hasher.digests) < full_blocks:
+                    hasher.digests.append(hashlib.md5(f.read(block_size)).hexdigest())
+                hasher.update(f.read(offset - full_blocks * block_size))
+        return hasher
+
+    def update(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            take = min(self.block_size - self._filled, len(view))
+            self._hash.update(view[:take])
+            self._filled += take
+            view = view[take:]
+
+            if self._filled == self.block_size:
+                self.digests.append(self._hash.hexdigest())
+                self._hash = hashlib.md5()
+                self._filled = 0
+
+    def finalize(self) -> list[str]:
+        if self._filled:
+            self.digests.append(self._hash.hexdigest())
+            self._hash = hashlib.md5()
+            self._filled = 0
+        return self.digests
+
+
+class BlockManifest:
+    @staticmethod
+    def path(filepath: str) -> str:
+        return filepath + ".blocks"
+
+    @staticmethod
+    def save(filepath: str, md5: str, block_size: int, blocks: list[str]):
+        try:
+            with open(BlockManifest.path(filepath), "w", encoding="utf-8") as file:
+                json.dump({"md5": md5, "block_size": block_size, "blocks": blocks}, file)
+        except IOError:
+            print(f"Unable to write block checksums: {filepath}")
+
+    @staticmethod
+    def load_partial(filepath: str, md5: str, block_size: int) -> list[str]:
+        try:
+            with open(BlockManifest.path(filepath), "r", encoding="utf-8") as file:
+                manifest: dict = json.load(file)
+        except (IOError, ValueError):
+            return []
+
+        if (
+            manifest.get("md5", "").lower() != md5.lower()
+            or manifest.get("block_size") != block_size
+        ):
+            return []
+        return manifest.get("blocks", [])
+
+    @staticmethod
+    def load(filepath: str, md5: str, filesize: int, block_size: int) -> list[str]:
+        blocks = BlockManifest.load_partial(filepath, md5, block_size)
+        if len(blocks) != BlockHasher.block_count(filesize, block_size):
+            return []
+        return blocks
+
+    @staticmethod
+    def remove(filepath: str):
+        try:
+            os.remove(BlockManifest.path(filepath))
+        except FileNotFoundError:
+            pass
+
+
 class IntegrityResult(TypedDict):
     filename: str
     filesize: int
@@ -501,10 +1239,54 @@ class IntegrityChecker:
         local_path = os.path.join(game_dir, remoteName)
         return local_path, expected_md5, expected_filesize
 
+    @staticmethod
+    def parse_shard(value: str) -> tuple[int, int]:
+        try:
+            index, count = (int(part) for part in value.split("/"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected I/N")
+
+        if count < 1 or not 1 <= index <= count:
+            raise argparse.ArgumentTypeError(
+                f"invalid shard '{value}', expected 1 <= I <= N"
+            )
+        return index, count
+
+    @staticmethod
+    def fingerprint(items: list[dict]) -> str:
+        hash_md5 = hashlib.md5()
+        for line in sorted(f"{item['remoteName']}:{item['md5']}" for item in items):
+            hash_md5.update(line.encode("utf-8"))
+        return hash_md5.hexdigest()
+
+    @staticmethod
+    def shard(items: list[dict], index: int, count: int) -> list[dict]:
+        # Largest files first, each to the least loaded shard. The order only depends on
+        # file size and a stable hash of the name, so every node computes the same split.
+        def stable_key(item: dict) -> tuple[int, str]:
+            name_hash = hashlib.md5(item["remoteName"].encode("utf-8")).hexdigest()
+            return -int(item["fileSize"]), name_hash
+
+        loads: list[int] = [0] * count
+        selected: list[dict] = []
+        for item in sorted(items, key=stable_key):
+            target = loads.index(min(loads))
+            loads[target] += int(item["fileSize"])
+            if target == index - 1:
+                selected.append(item)
+        return selected
+
     @staticmethod
     def check(game_dir: str, pkg_files: list, stop_on_mismatch: bool = True) -> None:
         combined_pkg_files = IntegrityChecker.combine(pkg_files)
+        return IntegrityChecker.check_items(
+            game_dir, combined_pkg_files, stop_on_mismatch=stop_on_mismatch
+        )
 
+    @staticmethod
+    def check_items(
+        game_dir: str, combined_pkg_files: list[dict], stop_on_mismatch: bool = True
+    ) -> None:
         if not combined_pkg_files:
             print("There is no file information to check.")
             return []
@@ -582,7 +1364,13 @@ class IntegrityChecker:
         pkg_files: list,
         stop_on_mismatch: bool = True,
         dump_results: str = False,
+        shard: tuple[int, int] = None,
     ):
+        if shard:
+            return IntegrityChecker.run_shard(
+                game_dir, pkg_files, shard, stop_on_mismatch, dump_results
+            )
+
         try:
             results = IntegrityChecker.check(
                 game_dir=game_dir, pkg_files=pkg_files, stop_on_mismatch=stop_on_mismatch
@@ -593,9 +1381,120 @@ class IntegrityChecker:
             results = []
 
         if dump_results and results:
-            with open("results.json", "w") as file:
+            with open(dump_results, "w") as file:
                 json.dump(results, file, indent=4, ensure_ascii=False)
 
+    @staticmethod
+    def run_shard(
+        game_dir: str,
+        pkg_files: list,
+        shard: tuple[int, int],
+        stop_on_mismatch: bool = True,
+        dump_results: str = False,
+    ):
+        index, count = shard
+        combined_pkg_files = IntegrityChecker.combine(pkg_files)
+        shard_items = IntegrityChecker.shard(combined_pkg_files, index, count)
+
+        print(
+            f"Shard {index}/{count}: {len(shard_items)} of {len(combined_pkg_files)} files "
+            f"({ApiParser._convert_bytes(sum(int(item['fileSize']) for item in shard_items))})"
+        )
+
+        try:
+            results = IntegrityChecker.check_items(
+                game_dir, shard_items, stop_on_mismatch=stop_on_mismatch
+            )
+            print("Integrity check done.")
+        except KeyboardInterrupt:
+            print("Integrity check canceled.")
+            return
+
+        output = dump_results or f"results.shard-{index}-of-{count}.json"
+        with open(output, "w") as file:
+            json.dump(
+                {
+                    "shard": index,
+                    "shards": count,
+                    "manifest": IntegrityChecker.fingerprint(combined_pkg_files),
+                    "total": len(shard_items),
+                    "results": results,
+                },
+                file,
+                indent=4,
+                ensure_ascii=False,
+            )
+        print(f"Shard results written to {output}")
+
+    @staticmethod
+    def merge(shard_files: list, dump_results: str = False) -> list[IntegrityResult]:
+        shards: dict[int, dict] = {}
+        for shard_file in shard_files:
+            try:
+                with open(shard_file, "r", encoding="utf-8") as file:
+                    data: dict = json.load(file)
+            except FileNotFoundError:
+                print(f"WARNING: Shard file '{shard_file}' not found. Skipping.")
+                continue
+            except ValueError:
+                print(f"WARNING: Shard file '{shard_file}' is not valid JSON. Skipping.")
+                continue
+
+            if not isinstance(data, dict) or not all(
+                key in data for key in ("shard", "shards", "manifest", "total", "results")
+            ):
+                print(f"WARNING: '{shard_file}' is not a shard result file. Skipping.")
+                continue
+
+            if data["shard"] in shards:
+                print(
+                    f"WARNING: '{shard_file}' is a duplicate of shard {data['shard']}. Skipping."
+                )
+                continue
+
+            if shards and (
+                data["shards"] != next(iter(shards.values()))["shards"]
+                or data["manifest"] != next(iter(shards.values()))["manifest"]
+            ):
+                print(f"WARNING: '{shard_file}' belongs to another verify run. Skipping.")
+                continue
+            shards[data["shard"]] = data
+
+        if not shards:
+            print("There are no shard results to merge.")
+            return []
+
+        count: int = next(iter(shards.values()))["shards"]
+        results: list[IntegrityResult] = []
+        complete = True
+        for index in range(1, count + 1):
+            if index not in shards:
+                print(f"Shard {index}/{count}: missing")
+                complete = False
+                continue
+
+            shard_results: list[IntegrityResult] = shards[index]["results"]
+            results.extend(shard_results)
+            print(
+                f"Shard {index}/{count}: checked {len(shard_results)}/{shards[index]['total']} files"
+            )
+            if len(shard_results) < shards[index]["total"]:
+                complete = False
+
+        summary: dict[str, int] = {}
+        for result in results:
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+
+        print("\nSummary:")
+        for status, amount in sorted(summary.items()):
+            print(f"=> {status}: {amount}")
+        if not complete:
+            print("WARNING: Report is incomplete, some files were not checked.")
+
+        with open(dump_results or "results.json", "w") as file:
+            json.dump(results, file, indent=4, ensure_ascii=False)
+        return results
+
 
 class ArgsHandler:
     def __init__(self):
@@ -638,6 +1537,20 @@ class ArgsHandler:
         self.parser.add_argument(
             "-o", "--path", type=str, help="download folder path", required=False
         )
+        self.parser.add_argument(
+            "--store",
+            type=str,
+            metavar="DIR",
+            help="shared package store, downloads are reused across download folders",
+            required=False,
+        )
+        self.parser.add_argument(
+            "--store-limit",
+            type=float,
+            metavar="GB",
+            help="evict least recently used packages when the store exceeds this size",
+            required=False,
+        )
         self.parser.add_argument(
             "--game-list",
             action="store_true",
@@ -653,12 +1566,21 @@ class ArgsHandler:
         self.verify_parser.add_argument(
             "game_dir",
             type=str,
+            help="game directory, or 'merge' to combine shard results given as pkg_files "
+            "(a directory named 'merge' takes precedence)",
         )
         self.verify_parser.add_argument(
             "pkg_files",
             nargs="+",
             type=str,
         )
+        self.verify_parser.add_argument(
+            "--shard",
+            type=IntegrityChecker.parse_shard,
+            metavar="I/N",
+            help="only check shard I of N and write its results for 'verify merge'",
+            required=False,
+        )
         self.verify_parser.add_argument(
             "--ignore-mismatch",
             action="store_true",
@@ -672,8 +1594,67 @@ class ArgsHandler:
             required=False,
         )
 
+        self.batch_parser = self.subparsers.add_parser(
+            "batch",
+            help="Download several games, versions and languages without prompts",
+        )
+        self.batch_parser.add_argument(
+            "job_file",
+            nargs="?",
+            type=str,
+            help="JSON or YAML job file",
+        )
+        self.batch_parser.add_argument(
+            "--games",
+            nargs="+",
+            type=str,
+            metavar="GAME",
+            help="game IDs or names from gamelist.json, or 'all'",
+            required=False,
+        )
+        self.batch_parser.add_argument(
+            "--versions",
+            nargs="+",
+            type=str,
+            default=["major"],
+            metavar="VERSION",
+            help="[pre_download:](major | patches | patch:<current version>)",
+            required=False,
+        )
+        # Same as the top-level options, accepted after 'batch' too. SUPPRESS keeps the
+        # top-level value when they are not given here.
+        self.batch_parser.add_argument(
+            "-t",
+            "--types",
+            type=str,
+            choices=["game_pkgs", "audio_pkgs", "all"],
+            default=argparse.SUPPRESS,
+            help="default data types, overridden by the job file",
+            required=False,
+        )
+        self.batch_parser.add_argument(
+            "-l",
+            "--languages",
+            nargs="+",
+            type=str,
+            default=argparse.SUPPRESS,
+            help="default audio languages, overridden by the job file",
+            required=False,
+        )
+        self.batch_parser.add_argument(
+            "-o",
+            "--path",
+            type=str,
+            default=argparse.SUPPRESS,
+            help="default download folder path, overridden by the job file",
+            required=False,
+        )
+
         self.args: argparse.Namespace = self.parser.parse_args()
 
+        if self.args.store_limit is not None and not self.args.store:
+            self.parser.error("--store-limit requires --store")
+
     def listener(self):
         if len(sys.argv) == 1:
             self.parser.print_help()
@@ -685,20 +1666,38 @@ class ArgsHandler:
             return
 
         if self.args.command == "verify":
+            if self.args.game_dir == "merge" and not os.path.isdir(self.args.game_dir):
+                if self.args.shard or self.args.ignore_mismatch:
+                    self.verify_parser.error(
+                        "--shard and --ignore-mismatch do not apply to 'verify merge'"
+                    )
+                IntegrityChecker.merge(
+                    shard_files=self.args.pkg_files,
+                    dump_results=self.args.export_result,
+                )
+                return
+
             IntegrityChecker.run(
                 game_dir=self.args.game_dir,
                 pkg_files=self.args.pkg_files,
                 stop_on_mismatch=not self.args.ignore_mismatch,
                 dump_results=self.args.export_result,
+                shard=self.args.shard,
             )
             return
 
+        types: list[str] = (
+            ["game_pkgs", "audio_pkgs"] if self.args.types == "all" else [self.args.types]
+        )
+
+        if self.args.command == "batch":
+            self.batch(types)
+            return
+
         # Fetch
         lst_of_pkgs: list[tuple[str, int, str], ...] = ApiParser().main(
             version=self.args.version,
-            types=["game_pkgs", "audio_pkgs"]
-            if self.args.types == "all"
-            else [self.args.types],
+            types=types,
             languages=self.args.languages,
             print_info=self.args.info,
         )
@@ -707,16 +1706,98 @@ class ArgsHandler:
         if self.args.info:
             return
 
+        self.download(lst_of_pkgs)
+
+    def batch(self, types: list[str]):
+        try:
+            spec: dict = (
+                BatchPlanner.load_spec(self.args.job_file) if self.args.job_file else {}
+            )
+        except JobSpecError as err:
+            print(err)
+            OSManager.exit(1)
+
+        if self.args.version == "patches":
+            self.batch_parser.error("-p/--patches does not apply, use --versions patches")
+
+        # Command line options are defaults, values from the job file take precedence
+        spec.setdefault("jobs", [])
+        spec.setdefault("types", types)
+        spec.setdefault("languages", self.args.languages)
+        spec.setdefault("path", self.args.path)
+        if self.args.games:
+            spec["jobs"].append(
+                {"games": self.args.games, "versions": self.args.versions}
+            )
+        if not spec["jobs"]:
+            self.batch_parser.error("a job file or --games is required")
+
+        try:
+            lst_of_pkgs: list[tuple[str, int, str, list[str]], ...] = BatchPlanner().plan(
+                spec
+            )
+        except JobSpecError as err:
+            print(err)
+            OSManager.exit(1)
+
+        if self.args.info or not lst_of_pkgs:
+            return
+
+        self.args.path = spec["path"]
+        self.download(lst_of_pkgs, show_total=True)
+
+    def download(self, lst_of_pkgs: list[tuple[str, int, str], ...], show_total=False):
         self.args.path = os.path.normpath(self.args.path) if self.args.path else ""
+        if self.args.path:
+            os.makedirs(self.args.path, exist_ok=True)
+
+        store: PackageStore = None
+        if self.args.store:
+            try:
+                store = PackageStore(
+                    root=self.args.store,
+                    max_size=int(self.args.store_limit * 1073741824)
+                    if self.args.store_limit is not None
+                    else None,
+                )
+            except StoreError as err:
+                print(err)
+                OSManager.exit(1)
 
         # Donwload
-        downloader: Downloader = Downloader(path=self.args.path)
-        file_hash: list[tuple[str, str]] = downloader.download_files(items=lst_of_pkgs)
+        downloader: Downloader = Downloader(path=self.args.path, store=store)
+        file_hash: list[tuple[str, str]] = downloader.download_files(
+            items=lst_of_pkgs, show_total=show_total
+        )
 
         # CRC check
         print("\033[F", end="")  # Move the cursor up one line
+        sources: dict[str, tuple[str, int]] = {
+            md5: (url, filesize) for url, filesize, md5, *_ in lst_of_pkgs
+        }
         for filepath, md5 in file_hash:
-            CheckHash.check_md5(filepath=filepath, expected_md5=md5)
+            if CheckHash.check_md5(filepath=filepath, expected_md5=md5) is not False:
+                continue
+
+            url, filesize = sources[md5]
+            if store:
+                store.repair(
+                    url=url,
+                    filename=os.path.basename(filepath),
+                    filesize=filesize,
+                    md5=md5,
+                    target_dir=os.path.dirname(filepath),
+                    block_size=downloader.block_size,
+                )
+            else:
+                Downloader(
+                    path=os.path.dirname(filepath), block_size=downloader.block_size
+                ).repair_file(
+                    url=url,
+                    filename=os.path.basename(filepath),
+                    filesize=filesize,
+                    md5=md5,
+                )
 
 
 def main():